@@ -12,5 +12,5 @@ setup(
     entry_points={'console_scripts': ['timetable=timetable.main:main']},
     zip_safe=False,
     install_requires=[
-        'docopt', 'attrs', 'requests-html', 'drawille', 'schema'
+        'docopt', 'attrs', 'requests', 'lxml', 'drawille', 'schema'
     ])
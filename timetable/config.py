@@ -1,9 +1,8 @@
-import configparser
 from enum import Enum
 
 from schema import And, Optional, Or, Schema, Use
 
-from . import timetable
+from . import fastconfig, timetable
 
 
 class TermColour(Enum):
@@ -42,6 +41,27 @@ class TermColour(Enum):
         return cls[colour_string.upper()]
 
 
+_SECTION_SCHEMA = Schema(
+    Or({
+        Optional('colour', default=TermColour.NONE):
+        Use(TermColour.from_colour_string, error='Invalid colour'),
+        'semester':
+        And(
+            Use(int, error='Invalid semester, should be an integer'),
+            lambda semester: 1 <= semester <= 2),
+        'year':
+        Use(int, error='Invalid year, should be an integer')
+    }, {
+        'activity':
+        And(
+            Use(int, error='Invalid activity, should be an integer'),
+            lambda activity: activity > 0)
+    }))
+
+_COURSE_PREFIX = 'course/'
+_COURSE_PREFIX_LEN = len(_COURSE_PREFIX)
+
+
 def parse_config(filename):
     ''' Parse a config file at filename.
 
@@ -50,30 +70,12 @@ def parse_config(filename):
 
     Returns:
         dict: The parsed dictionary. '''
-    section_schema = Schema(
-        Or({
-            Optional('colour', default=TermColour.NONE):
-            Use(TermColour.from_colour_string, error='Invalid colour'),
-            'semester':
-            And(
-                Use(int, error='Invalid semester, should be an integer'),
-                lambda semester: 1 <= semester <= 2),
-            'year':
-            Use(int, error='Invalid year, should be an integer')
-        }, {
-            'activity':
-            And(
-                Use(int, error='Invalid activity, should be an integer'),
-                lambda activity: activity > 0)
-        }))
     with open(filename, 'r') as infile:
-        parser = configparser.ConfigParser()
-        parser.read_file(infile)
-        config = {
-            s: section_schema.validate(dict(parser.items(s)))
-            for s in parser.sections()
-        }
-        return config
+        sections = fastconfig.parse(infile)
+    return {
+        section: _SECTION_SCHEMA.validate(items)
+        for section, items in sections.items()
+    }
 
 
 def get_courses(config):
@@ -83,15 +85,12 @@ def get_courses(config):
         config (dict): The parsed config file.
     Returns:
         list of timetable.Course: The courses pull from the config file. '''
-    courses = []
-
-    for section in config:
-        if section.startswith('course/'):
-            title = section[len('course/'):]
-            year = config[section]['year']
-            semester = config[section]['semester']
-            courses.append(timetable.Course(title, year, semester))
-    return courses
+    return [
+        timetable.Course(section[_COURSE_PREFIX_LEN:], items['year'],
+                         items['semester'])
+        for section, items in config.items()
+        if section.startswith(_COURSE_PREFIX)
+    ]
 
 
 def get_selected_activities(config, courses):
@@ -105,12 +104,11 @@ def get_selected_activities(config, courses):
         dict: A mapping from (course title, activity name) to the selected activity. '''
     selected_activities = {}
     for course in courses:
-        selected_activities.update({
-            (course.title, activity.name):
-            config[f'{course.title}/{activity.name}']['activity']
-            for activity in course.activities
-            if 'activity' in config.get(f'{course.title}/{activity.name}', {})
-        })
+        for activity in course.activities:
+            section = config.get(f'{course.title}/{activity.name}')
+            if section and 'activity' in section:
+                selected_activities[(course.title,
+                                     activity.name)] = section['activity']
     return selected_activities
 
 
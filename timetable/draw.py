@@ -42,14 +42,18 @@ def box(canvas, x, y, width, height, contents):
         height (int): The height of the box.
         contents (str): Text to put in the box. '''
     lines = contents.split('\n')
-    # Top of box
-    line(canvas, x, y, x + width, y)
-    # Bottom of box
-    line(canvas, x, y + height, x + width, y + height)
-    # Left of box
-    line(canvas, x, y, x, y + height)
-    # Right of box
-    line(canvas, x + width, y, x + width, y + height)
+    right = x + width
+    bottom = y + height
+    # The sides of the box are straight, so rather than interpolating
+    # each side with drawille.line we can walk the pixels directly.
+    # Top and bottom of box
+    for x_l in range(x, right + 1):
+        canvas.set(x_l, y)
+        canvas.set(x_l, bottom)
+    # Left and right of box
+    for y_l in range(y, bottom + 1):
+        canvas.set(x, y_l)
+        canvas.set(right, y_l)
     for y_l, text_line in zip(range(y + 4, y + height, 4), lines):
         canvas.set_text(x + 4, y_l, text_line)
 
@@ -72,7 +76,7 @@ def timeline(canvas, x, y, box_width, box_height, mapping):
     # We need to pad out the divider of the timeline to put it, so we
     # take the max of the keys (to be on the left of the timeline),
     # and add 2 pixels for some aesthetic padding.
-    left_padding = max(text_len(text) for text in mapping) + 2
+    left_padding = text_len(max(mapping, key=len)) + 2
     # To calculate the height of the timeline, we need to take the
     # number of keys and multiply that by the box height + 4 pixels of
     # padding in between each box.
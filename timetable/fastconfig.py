@@ -0,0 +1,89 @@
+import re
+
+SECTION_RE = re.compile(r'\[([^\]]+)\]')
+# Same as configparser's option pattern: the key is everything up to
+# the first '=' or ':'.
+KV_RE = re.compile(r'(.*?)\s*[=:]\s*(.*)')
+# Like configparser, the keys of this section are defaults for every
+# other section.
+DEFAULT_SECTION = 'DEFAULT'
+
+
+def parse(infile):
+    ''' Parse an INI style file into a dictionary of sections.
+
+    This understands only the subset of the INI format the config
+    file uses: section headers, key = value (or key: value) pairs,
+    values continued on indented lines and whole line comments
+    starting with '#' or ';'. Keys are lower cased, and the keys of the
+    DEFAULT section are copied into every other section. Like a strict
+    configparser, a section (other than DEFAULT) or a key within a
+    section may only appear once.
+
+    Args:
+        infile (file): An open file (or any iterable of lines) to parse.
+
+    Returns:
+        dict: A mapping from section name to a dictionary of the keys
+              and values in that section.
+
+    Raises:
+        ValueError: If a line is not a section header, key value pair
+                    or comment, if a key appears before any section, or
+                    if a section or key is repeated.
+
+    Examples:
+        >>> parse(['[course/SENG201]', 'year = 2018'])
+        {'course/SENG201': {'year': '2018'}} '''
+    sections = {}
+    section = None
+    name = None
+    key = None
+    # The indentation of the current key, lines indented past it
+    # continue its value.
+    indent = 0
+    # Blank lines seen since the last line of the current value, kept
+    # if the value continues after them.
+    blanks = 0
+    for raw_line in infile:
+        line = raw_line.strip()
+        if not line:
+            blanks += 1
+            continue
+        if line[0] in '#;':
+            continue
+        line_indent = len(raw_line) - len(raw_line.lstrip())
+        if key is not None and line_indent > indent:
+            section[key] += '\n' * (blanks + 1) + line
+            blanks = 0
+            continue
+        blanks = 0
+        if line[0] == '[':
+            match = SECTION_RE.fullmatch(line)
+            if match is None:
+                raise ValueError(f'{repr(line)} is not a valid section header.')
+            name = match.group(1)
+            if name in sections and name != DEFAULT_SECTION:
+                raise ValueError(f'Section {repr(name)} appears twice.')
+            section = sections.setdefault(name, {})
+            key = None
+            continue
+        match = KV_RE.fullmatch(line)
+        if match is None or not match.group(1):
+            raise ValueError(f'{repr(line)} is not a valid key value pair.')
+        if section is None:
+            raise ValueError(f'{repr(line)} does not belong to a section.')
+        key, value = match.groups()
+        key = key.lower()
+        if key in section:
+            raise ValueError(
+                f'Key {repr(key)} appears twice in section {repr(name)}.')
+        section[key] = value.strip()
+        indent = line_indent
+    defaults = sections.pop(DEFAULT_SECTION, None)
+    if defaults:
+        sections = {
+            name: {**defaults, **items}
+            for name, items in sections.items()
+        }
+    return sections
@@ -13,26 +13,74 @@ Options:
     -t, --timeline     Show your timetable in a fancy timeline.
     -v, --verbose      Be more verbose.
 """
-import calendar
+import bisect
+import gc
 import itertools
 import os
 import pathlib
 import pickle
+import sys
 from collections import OrderedDict, defaultdict
 from datetime import datetime, timedelta
 
 from drawille import Canvas
 
-from docopt import docopt
 from schema import Or, Schema, SchemaError, Use
 
 from . import config, draw, timetable
 
 COMMAND_MAP = {}
 
+# The names of the days of the week, indexed by datetime.weekday().
+_DAY_NAMES = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday',
+              'Saturday', 'Sunday')
+_WORK_DAYS = 5
+
+# Bump this whenever the layout of the data file, or of the classes
+# pickled into it, changes so that stale data files are refetched.
+DATA_VERSION = 8
+
+# Likewise for the parsed config cache, bump this whenever the config
+# schema or the classes it produces (e.g config.TermColour) change.
+CONFIG_CACHE_VERSION = 1
+
+# Everything that reading back a truncated, stale or otherwise
+# unusable pickle can raise.
+_BAD_CACHE_ERRORS = (OSError, EOFError, pickle.UnpicklingError,
+                     AttributeError, ImportError, IndexError, TypeError,
+                     ValueError)
+
+# How long to trust a cached course that has no activities before
+# checking the course page again.
+EMPTY_COURSE_TTL = timedelta(days=7)
+
+
+def parse_date(date_string):
+    ''' Parse a date given on the command line.
+
+    Args:
+        date_string (str): A date in the form YYYY-MM-DD.
+
+    Returns:
+        datetime: The date parsed from the string.
+
+    Raises:
+        ValueError: If the string is not a valid date.
+
+    Examples:
+        >>> parse_date('2018-3-5')
+        datetime.datetime(2018, 3, 5, 0, 0) '''
+    try:
+        return datetime.fromisoformat(date_string)
+    except ValueError:
+        # fromisoformat is fast but only accepts zero padded months
+        # and days, strptime takes '2018-3-5' too.
+        return datetime.strptime(date_string, '%Y-%m-%d')
+
+
 COMMAND_SCHEMA = Schema({
     '--on':
-    Or(Use(lambda v: datetime.strptime(v, '%Y-%m-%d')), None),
+    Or(Use(parse_date), None),
     '--drop-cache':
     bool,
     '--time':
@@ -67,46 +115,145 @@ def command(name):
     return decorator
 
 
-def get_config():
+class LazyCourses:
+    ''' A mapping from (title, year, semester) to course, unpickled on demand.
+
+    Each course in the data file is pickled separately, so only the
+    courses that are actually looked up pay the cost of unpickling.
+
+    Attributes:
+        blobs (dict): A mapping from (title, year, semester) to the
+                      pickled course.
+        courses (dict): The courses unpickled so far. '''
+
+    def __init__(self, blobs):
+        self.blobs = blobs
+        self.courses = {}
+
+    def __contains__(self, key):
+        return key in self.blobs
+
+    def __getitem__(self, key):
+        if key not in self.courses:
+            # A course is a large tree of small objects, disabling the
+            # garbage collector stops it from repeatedly scanning the
+            # partially loaded tree.
+            gc.disable()
+            try:
+                self.courses[key] = pickle.loads(self.blobs[key])
+            finally:
+                gc.enable()
+        return self.courses[key]
+
+
+def load_config(config_file, cache_path, drop_cache=False):
+    ''' Parse the config file, reusing the cached result where possible.
+
+    The parsed config is pickled to cache_path alongside
+    CONFIG_CACHE_VERSION and the modification time and size of the
+    config file. As long as those all still match, the cached copy is
+    returned instead of parsing the config file again. A cache that
+    cannot be read back is treated as missing.
+
+    Args:
+        config_file (pathlib.Path): The location of the config file.
+        cache_path (pathlib.Path): The location of the parsed config cache.
+        drop_cache (bool): Ignore (and overwrite) the cached copy.
+
+    Returns:
+        dict: The parsed config file. '''
+    stat = config_file.stat()
+    key = (CONFIG_CACHE_VERSION, stat.st_mtime, stat.st_size)
+    if not drop_cache and cache_path.exists():
+        try:
+            with open(cache_path, 'rb') as infile:
+                cached_key, cached_config = pickle.load(infile)
+        except _BAD_CACHE_ERRORS:
+            pass
+        else:
+            if cached_key == key:
+                return cached_config
+    config_dict = config.parse_config(config_file)
+    tmp_path = cache_path.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as out:
+        pickle.dump((key, config_dict), out)
+    os.replace(tmp_path, cache_path)
+    return config_dict
+
+
+def get_config(drop_cache=False):
     ''' Get all configuration files/data from the config directory.
 
     "the config directory" in this context means the path specified by
     the TIMETABLE_CONFIG_PATH environment variable.
 
+    Args:
+        drop_cache (bool): Ignore the data file, and reparse the config
+                           file even if it is unchanged.
+
     Returns:
-        (pathlib.Path, list of courses, dict): The
-        path to the configuration directory, the list of courses found in
-        the data file there, and the parsed config file. '''
+        (pathlib.Path, LazyCourses, dict): The path to the configuration
+        directory, the courses found in the data file there (or None if
+        there is no usable data file, or it was dropped), and the parsed
+        config file. '''
     config_path = pathlib.Path(os.getenv('TIMETABLE_CONFIG_PATH'))
     data_path = config_path / 'data'
     config_file = config_path / 'config'
     data = None
-    if data_path.exists():
-        with open(data_path, 'rb') as infile:
-            data = pickle.load(infile)
-    return config_path, data, config.parse_config(config_file)
+    if not drop_cache and data_path.exists():
+        try:
+            # Read the file in one go so the unpickler works from
+            # memory rather than issuing a read call for every frame.
+            version, blobs = pickle.loads(data_path.read_bytes())
+        except _BAD_CACHE_ERRORS:
+            # A data file that cannot be read back is no worse than
+            # none at all, everything just gets fetched again.
+            pass
+        else:
+            if version == DATA_VERSION:
+                data = LazyCourses(blobs)
+    config_dict = load_config(config_file, config_path / 'config.cache.pkl',
+                              drop_cache)
+    return config_path, data, config_dict
+
+
+def coloured_titles(config_dict, courses):
+    ''' Colour the titles of the given courses.
+
+    Args:
+        config_dict (dict): Used to obtain the colour of each course.
+        courses (list of timetable.Course): The courses to colour.
+
+    Returns:
+        dict: A mapping from course title to the title wrapped in the
+              ANSI escape sequences for the course's colour. '''
+    reset = config.TermColour.RESET.value
+    titles = {}
+    for course in courses:
+        colour = config.colour_of_course(config_dict, course)
+        titles[course.title] = f'{colour.value}{course.title}{reset}'
+    return titles
 
 
-def print_activity(config_dict, date, course, activity):
-    ''' Print an activity.
+def format_activity(titles, date, course, activity):
+    ''' Format an activity as a line of text.
 
-    Prints an activity in the context of the course it belongs to, the
+    Formats an activity in the context of the course it belongs to, the
     current date, and the colours specified by the user.
 
     Args:
-        config_dict (dict): Used to obtain the colour to print the course
-                       in.
+        titles (dict): The coloured course titles, see coloured_titles.
         date (datetime.datetime): The date to filter locations by.
         course (timetable.Course): The parent course of the activity.
-        activity (timetable.Activity): The activity to print. '''
+        activity (timetable.Activity): The activity to format.
+
+    Returns:
+        str: The formatted activity. '''
     relevant_location = activity.location_valid_for(date)
-    start = activity.start.strftime('%H:%M')
-    colour = config.colour_of_course(config_dict, course)
-    title = f'{colour.value}{course.title}{config.TermColour.RESET.value}'
-    end = activity.end.strftime('%H:%M')
-    print(
-        f'{start} - {end} :: {title} {activity.name} @ {relevant_location.place}'
-    )
+    start = timetable.format_minutes(activity.start)
+    title = titles[course.title]
+    end = timetable.format_minutes(activity.end)
+    return f'{start} - {end} :: {title} {activity.name} @ {relevant_location.place}'
 
 
 def print_timeline(config_dict, date, activities):
@@ -144,9 +291,9 @@ def print_timeline(config_dict, date, activities):
     # activities based on their start time.
     mapping = OrderedDict()
     for course, activity, location in activities:
-        key = activity.start.strftime('%H:%M')
+        key = timetable.format_minutes(activity.start)
         map_bin = mapping.get(key, [])
-        activity_text = f'{course.title}\n\n{activity.name}\n{location.place}\n{activity.end:%H:%M}'
+        activity_text = f'{course.title}\n\n{activity.name}\n{location.place}\n{timetable.format_minutes(activity.end)}'
         map_bin.append(activity_text)
         mapping[key] = map_bin
 
@@ -162,37 +309,33 @@ def find_day_of_week(date, weekday):
 def print_week_timetable(config_dict, date, courses, selected_activities):
     dates = [
         find_day_of_week(date, day)
-        for day in range(calendar.MONDAY, calendar.SATURDAY)
+        for day in range(_WORK_DAYS)
     ]
     day_activities = list(
-        itertools.chain(*(
+        itertools.chain.from_iterable(
             timetable.activities_on(courses, date, selected_activities)
-            for date in dates)))
+            for date in dates))
     if len(day_activities) == 0:
         return
-    earliest_time = min(day_activities, key=lambda act: act[1].start)[1].start
-    latest_time = max(day_activities, key=lambda act: act[1].end)[1].end
-    earliest_time = earliest_time.replace(minute=0, second=0)
-    if latest_time.minute + latest_time.second > 0:
-        latest_time = (latest_time + timedelta(hours=1)).replace(
-            minute=0, second=0)
+    earliest_time = min(activity.start for _, activity in day_activities)
+    latest_time = max(activity.end for _, activity in day_activities)
+    # The table has one row per hour, so everything from here on is
+    # binned by the hour of the day.
+    earliest_hour = earliest_time // 60
+    latest_hour, latest_minute = divmod(latest_time, 60)
+    if latest_minute > 0:
+        latest_hour += 1
     rendered_activities = defaultdict(list)
     for course, activity in day_activities:
-        hours = activity.end.hour - activity.start.hour
-        for hour in range(hours):
-            dt = date.replace(hour=activity.start.hour, minute=0, second=0)
-            rendered_activities[(activity.day,
-                                 (dt + timedelta(hours=hour)).time()
-                                 )].append(f'{course.title} {activity.name}')
-    rendered_timetable = [[''] + calendar.day_name[:5]]
-
-    hours = latest_time.hour - earliest_time.hour
-    for hour in range(hours):
-        e_dt = date.replace(hour=earliest_time.hour, minute=0, second=0)
-        dt = (e_dt + timedelta(hours=hour)).time()
-        row = [dt.strftime('%H:%M')]
-        for day in range(len(calendar.day_name) - 2):
-            row.append('\n'.join(rendered_activities[(day, dt)]))
+        label = f'{course.title} {activity.name}'
+        for hour in range(activity.start // 60, activity.end // 60):
+            rendered_activities[(activity.day, hour)].append(label)
+    rendered_timetable = [[''] + list(_DAY_NAMES[:_WORK_DAYS])]
+
+    for hour in range(earliest_hour, latest_hour):
+        row = [f'{hour:02d}:00']
+        for day in range(_WORK_DAYS):
+            row.append('\n'.join(rendered_activities[(day, hour)]))
         rendered_timetable.append(row)
 
     canvas = Canvas()
@@ -221,21 +364,28 @@ def show_timetable(config_dict, courses, selected_activities, args):
         args (dict): Additional command line arguments. '''
     date = args['--on'] or datetime.now()
     activities = timetable.activities_on(courses, date, selected_activities)
-    day = calendar.day_name[date.weekday()]
+    day = _DAY_NAMES[date.weekday()]
     isodate = date.date().isoformat()
-    print(f'Showing timetable for {day}, {isodate}')
+    header = f'Showing timetable for {day}, {isodate}'
     if args['--timeline'] is True:
+        print(header)
         print_timeline(config_dict, date, activities)
     else:
-        for course, activity in activities:
-            print_activity(config_dict, date, course, activity)
+        titles = coloured_titles(config_dict, courses)
+        # Write the whole timetable at once rather than a line at a time.
+        lines = [header]
+        lines.extend(
+            format_activity(titles, date, course, activity)
+            for course, activity in activities)
+        sys.stdout.write('\n'.join(lines) + '\n')
 
 
 @command('next')
 def show_next(config_dict, courses, selected_activities, args):
-    ''' Show a timetable for a particular date.
+    ''' Show the next activities for today.
 
-    This is the output of the 'show' subcommand.
+    This is the output of the 'next' subcommand. If several activities
+    start at the same time (i.e they clash), all of them are shown.
 
     Args:
         config_dict (dict): The parsed configuration file.
@@ -245,45 +395,89 @@ def show_next(config_dict, courses, selected_activities, args):
         args (dict): Additional command line arguments. '''
     now = datetime.now()
     activities = timetable.activities_on(courses, now, selected_activities)
-    next_activity = next(((course, activity) for course, activity in activities
-                          if activity.start > now.time()), None)
-    if next_activity is not None and args['--time']:
-        course, act = next_activity
-        time_dt = now.replace(hour=act.start.hour, minute=act.start.minute)
+    # activities is sorted by start time, so the next activities are
+    # the run starting at the first one to start strictly after now.
+    starts = [activity.start for _, activity in activities]
+    first = bisect.bisect_right(starts, now.hour * 60 + now.minute)
+    if first == len(activities):
+        return
+    next_start = starts[first]
+    last = bisect.bisect_right(starts, next_start, first)
+    if args['--time']:
+        hour, minute = divmod(next_start, 60)
+        time_dt = now.replace(hour=hour, minute=minute)
         delta = time_dt - now
         print(delta)
-    elif next_activity is not None:
-        course, act = next_activity
-        print_activity(config_dict, now, course, act)
+    else:
+        titles = coloured_titles(config_dict, courses)
+        for course, act in activities[first:last]:
+            print(format_activity(titles, now, course, act))
 
 
 def main():
     ''' Main function. '''
+    # docopt is only needed to run the command line interface, so
+    # importing this module elsewhere should not pay for it.
+    from docopt import docopt
     arguments = docopt(__doc__, version='Timetable 0.1.0.')
     try:
         arguments = COMMAND_SCHEMA.validate(arguments)
     except SchemaError:
         exit(__doc__)
     try:
-        config_path, data, config_dict = get_config()
-    except SchemaError as e:
+        config_path, data, config_dict = get_config(
+            arguments['--drop-cache'])
+    except (SchemaError, ValueError) as e:
         if arguments['--verbose']:
-            exit(e.code)
+            exit(str(e))
         else:
             exit('Failed to parse config.')
+    if data is None:
+        data = LazyCourses({})
     courses = config.get_courses(config_dict)
-    if data is None or arguments['--drop-cache']:
-        for course in courses:
-            course.fetch_activities()
-    else:
-        courses = data
+    fetched = set()
+    today = datetime.now().date()
+    for i, course in enumerate(courses):
+        key = (course.title, course.year, course.semester)
+        if key in data:
+            cached = data[key]
+            # A course page with no activities may just not have been
+            # published yet, so it is worth checking again every so
+            # often.
+            if (cached.activities
+                    or today - cached.fetched_at <= EMPTY_COURSE_TTL):
+                courses[i] = cached
+                continue
+        course.fetch_activities()
+        fetched.add(key)
     selected_activities = config.get_selected_activities(config_dict, courses)
     # Find first callback that docopt believes has been called.
     callback = next(callback for cmd, callback in COMMAND_MAP.items()
                     if arguments[cmd] is True)
     callback(config_dict, courses, selected_activities, arguments)
-    with open(config_path / 'data', 'wb') as out:
-        pickle.dump(courses, out)
+    # The commands never modify the courses, so the data file only
+    # needs rewriting when a course was fetched.
+    if not fetched:
+        return
+    blobs = {}
+    for course in courses:
+        key = (course.title, course.year, course.semester)
+        if key in fetched:
+            blobs[key] = pickle.dumps(
+                course, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            # The course came from the data file unchanged, so its
+            # pickle can be written back as is.
+            blobs[key] = data.blobs[key]
+    # Write to a temporary file first, so an interrupted write cannot
+    # leave a truncated data file behind.
+    data_path = config_path / 'data'
+    tmp_path = data_path.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as out:
+        pickle.dump((DATA_VERSION, blobs),
+                    out,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, data_path)
 
 
 if __name__ == '__main__':
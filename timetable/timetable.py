@@ -1,14 +1,185 @@
 import calendar
-import itertools
+import datetime as dt
+import functools
 import re
-from datetime import datetime
+import sys
+from operator import attrgetter
 
 import attr
-from requests_html import HTMLSession
 
 UC_URL = 'http://www.canterbury.ac.nz/courseinfo/GetCourseDetails.aspx'
-LOCATION_RE = r'^(?P<name>.+?)?\((?P<date>.+?)\)?$'
+# Seconds to wait on the course pages before giving up.
+FETCH_TIMEOUT = 10
 ID_RE = r'^(?P<id>\d+)(-P(?P<part>\d+))?'
+_ID_RE = re.compile(ID_RE)
+_TIME_RE = re.compile(r'(\d\d?):(\d\d)\s*-\s*(\d\d?):(\d\d)')
+_MONTHS = {abbr: i for i, abbr in enumerate(calendar.month_abbr) if abbr}
+_DAY_INDEX = {name: i for i, name in enumerate(calendar.day_name)}
+# Elements whose text flows on with the text around them, any other
+# element starts and ends a line. br is listed too, but breaks the line
+# itself.
+_INLINE_TAGS = frozenset({
+    'a', 'abbr', 'acronym', 'b', 'bdo', 'big', 'br', 'button', 'cite',
+    'code', 'dfn', 'em', 'i', 'img', 'input', 'kbd', 'label', 'map',
+    'object', 'q', 'samp', 'script', 'select', 'small', 'span', 'strong',
+    'sub', 'sup', 'textarea', 'time', 'tt', 'var'
+})
+# Whitespace as HTML defines it (which, unlike str.split, leaves
+# non-breaking spaces alone).
+_HTML_SPACE_RE = re.compile('[\x20\x09\x0c\u200b\x0a\x0d]+')
+
+
+@functools.lru_cache(maxsize=None)
+def http_session():
+    ''' Get the HTTP session shared by all course fetches.
+
+    Sharing a session lets every course page after the first reuse the
+    same connection to the course info server.
+
+    Returns:
+        requests.Session: The shared session. '''
+    # requests is slow to import and only needed when scraping,
+    # which most invocations never do.
+    import requests
+    return requests.Session()
+
+
+@functools.lru_cache(maxsize=None)
+def _rows_xpath():
+    ''' Get the XPath that finds the rows of a course page.
+
+    Returns:
+        lxml.etree.XPath: An XPath selecting the section header bodies
+                          and activity rows of a course page, in
+                          document order. '''
+    # Like requests, lxml is only needed when scraping.
+    from lxml import etree
+    return etree.XPath(
+        '//table[@id="RepeatTable"]//tbody'
+        ' | //tr[contains(concat(" ", normalize-space(@class), " "), " datarow ")]')
+
+
+def _text_parts(element, parts):
+    ''' Append the text of element to parts, marking line breaks.
+
+    Text is appended as str, a <br> as True and the start or end of a
+    block element (anything not in _INLINE_TAGS) as None. '''
+    tag = element.tag
+    # Comments and processing instructions have a factory for a tag,
+    # and no text of their own.
+    if not isinstance(tag, str):
+        return
+    block = tag not in _INLINE_TAGS
+    if tag == 'br':
+        parts.append(True)
+    elif block:
+        parts.append(None)
+    if element.text is not None:
+        parts.append(element.text)
+    for child in element:
+        _text_parts(child, parts)
+        if child.tail is not None:
+            parts.append(child.tail)
+    if block:
+        parts.append(None)
+
+
+def element_text(element):
+    ''' Get the text of an HTML element, as it would be displayed.
+
+    Text inside inline elements (e.g <a> or <strong>) runs on with the
+    text around it, while <br> and block elements start a new line.
+    Runs of whitespace are squashed to a single space. This is the
+    same text requests_html (by way of pyquery) gives.
+
+    Args:
+        element (lxml.html.HtmlElement): The element to get the text of.
+
+    Returns:
+        str: The text of the element.
+
+    Examples:
+        >>> from lxml import html
+        >>> element_text(html.fromstring(
+        ...     '<td><a>Jack Erskine 031</a> (26/2-6/4)<br>Rehua 101</td>'))
+        'Jack Erskine 031 (26/2-6/4)\\nRehua 101' '''
+    parts = []
+    _text_parts(element, parts)
+    # Merge each run of text between two breaks into one line, dropping
+    # the lines that are only whitespace.
+    lines = []
+    run = []
+    for part in parts + [None]:
+        if isinstance(part, str):
+            run.append(part)
+            continue
+        line = _HTML_SPACE_RE.sub(' ', ''.join(run)).strip()
+        run = []
+        if line:
+            lines.append(line)
+        # A <br> always breaks the line, but any number of block
+        # boundaries in a row count as a single break.
+        if part is True or (lines and lines[-1] is not None):
+            lines.append(part)
+    # Stripping drops the breaks at either end.
+    return ''.join('\n' if line is None or line is True else line
+                   for line in lines).strip()
+
+
+def format_minutes(minutes):
+    ''' Format a time of day expressed in minutes after midnight.
+
+    Args:
+        minutes (int): The number of minutes after midnight.
+
+    Returns:
+        str: The time of day in the form HH:MM.
+
+    Examples:
+        >>> format_minutes(13 * 60 + 5)
+        '13:05' '''
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours:02d}:{minutes:02d}'
+
+
+def parse_week_date(in_year, date_string):
+    ''' Parse a date in the form '<day> <abbreviated month>'.
+
+    Args:
+        in_year (int): The year to interpret the date in.
+        date_string (str): The date to parse.
+
+    Returns:
+        date: The date parsed from the string.
+
+    Examples:
+        >>> parse_week_date(2018, '2 Apr')
+        datetime.date(2018, 4, 2) '''
+    try:
+        day, month = date_string.split()
+        return dt.date(in_year, _MONTHS[month], int(day))
+    except (KeyError, ValueError):
+        # Anything unusual (e.g a month in a different case) is left
+        # to strptime.
+        return dt.datetime.strptime(date_string.strip(),
+                                    '%d %b').replace(year=in_year).date()
+
+
+def parse_day_month(in_year, date_string):
+    ''' Parse a date in the form '<day>/<month>'.
+
+    Args:
+        in_year (int): The year to interpret the date in.
+        date_string (str): The date to parse.
+
+    Returns:
+        date: The date parsed from the string.
+
+    Examples:
+        >>> parse_day_month(2018, '28/3')
+        datetime.date(2018, 3, 28) '''
+    day, month = date_string.split('/')
+    return dt.date(in_year, int(month), int(day))
 
 
 def parse_week_interval(in_year, interval_string):
@@ -19,23 +190,27 @@ def parse_week_interval(in_year, interval_string):
         interval_string (str): The interval to parse.
 
     Returns:
-        (date, date): The interval parsed from the string.
+        (date, date): The interval parsed from the string. An interval
+                      of a single day starts and ends on that day.
 
     Examples:
         >>> parse_week_interval(2018, '2 Apr - 3 Apr')
-        (datetime.date(2018, 4, 2), datetime.date(2018, 4, 3)) '''
-    return tuple(
-        datetime.strptime(date.strip(), '%d %b').replace(year=in_year).date()
-        for date in interval_string.split('-'))
+        (datetime.date(2018, 4, 2), datetime.date(2018, 4, 3))
+        >>> parse_week_interval(2018, '2 Apr')
+        (datetime.date(2018, 4, 2), datetime.date(2018, 4, 2)) '''
+    dates = [
+        parse_week_date(in_year, date_string)
+        for date_string in interval_string.split('-')
+    ]
+    return (dates[0], dates[-1])
 
 
 def date_in_intervals(date, intervals):
     ''' Determine if a date is in a given list of intervals
 
     Note:
-        The elements of the interval list are either a pair of
-        datetimes (a range interval), or a single datetime wrapped in
-        a tuple (an instant interval).
+        Both ends of each interval are inclusive, so an interval over a
+        single day starts and ends on that day.
 
     Args:
         date (date): The date to query.
@@ -47,22 +222,13 @@ def date_in_intervals(date, intervals):
     Examples:
     >>> date_in_intervals(datetime.datetime(2018, 3, 2), [(datetime.date(2018, 3, 1), datetime.date(2018, 3, 3))])
     True '''
-    for interval in intervals:
-        # Two cases for any interval
-        # No end date is specified: it's an interval that occurs
-        # over one day (an instant interval).
-        # An end date is specified: it's an interval that occurs
-        # over one or more days (a range interval).
-        instant_interval_is_valid = len(interval) == 1 and date == interval[0]
-        range_interval_is_valid = len(
-            interval) == 2 and interval[0] <= date <= interval[1]
-        if instant_interval_is_valid or range_interval_is_valid:
+    # If the intervals is empty it is assumed valid for all days.
+    if not intervals:
+        return True
+    for start, end in intervals:
+        if start <= date <= end:
             return True
-
-    # If the intervals is empty it is assumed valid for all
-    # days. Otherwise the for loop found no valid intervals
-    # matching this day, so we return False.
-    return len(intervals) == 0
+    return False
 
 
 def parse_id(id_string):
@@ -96,7 +262,7 @@ def parse_id(id_string):
         (1, 1)
         >>> parse_id('1')
         (1, None) '''
-    match = re.match(ID_RE, id_string)
+    match = _ID_RE.match(id_string)
     if match is None:
         raise ValueError(f'{repr(id_string)} is not a valid ID string.')
     match_dict = match.groupdict()
@@ -104,7 +270,7 @@ def parse_id(id_string):
     return (int(match_dict['id']), int(id_part) if id_part else id_part)
 
 
-@attr.s
+@attr.s(slots=True, frozen=True)
 class Location:
     ''' The location class represents a single location a class may occur in.
 
@@ -115,9 +281,9 @@ class Location:
 
     Attributes:
         place (str): A description of the physical location, e.g C2 Lecture Theatre.
-        valid_intervals (list of (date, date)): A list of intervals for which the location is valid. '''
+        valid_intervals (tuple of (date, date)): The intervals for which the location is valid. '''
     place = attr.ib()
-    valid_intervals = attr.ib(default=attr.Factory(list))
+    valid_intervals = attr.ib(default=())
 
     @classmethod
     def from_string(cls, in_year, location_string):
@@ -135,26 +301,27 @@ class Location:
 
         Examples:
             >>> Location.from_string(2018, 'Jack Erskine 001 Computer Lab (28/3)')
-            Location(place='Jack Erskine 001 Computer Lab', valid_intervals=[(datetime.date(2018, 3, 28),)]) '''
-        location_match = re.match(LOCATION_RE, location_string)
-        if location_match is None:
-            name = location_string
-            return cls(name)
-        else:
-            location_string, date_string = location_match.groups(default='')
-
-            name = location_string.strip()
-            intervals = date_string.split(', ')
-            # Intervals is a list of some elements in the form ['d/m',
-            # 'd/m-d/m', ...]. So we iterate, split and parse the
-            # dates. The result is a tuple of one or two elements
-            # representing the start and (maybe) end dates.
-            valid_intervals = [
-                tuple(
-                    datetime.strptime(d, '%d/%m').replace(year=in_year).date()
-                    for d in interval.split('-')) for interval in intervals
-            ]
-            return cls(name, valid_intervals)
+            Location(place='Jack Erskine 001 Computer Lab', valid_intervals=((datetime.date(2018, 3, 28), datetime.date(2018, 3, 28)),)) '''
+        # The place is everything before the first parenthesis, and
+        # the dates everything after it (less the closing parenthesis).
+        place, paren, date_string = location_string.partition('(')
+        if not paren or not date_string:
+            return cls(sys.intern(location_string))
+        if date_string.endswith(')'):
+            date_string = date_string[:-1]
+
+        # The same few rooms come up over and over again.
+        name = sys.intern(place.strip())
+        intervals = date_string.split(', ')
+        # Intervals is a list of some elements in the form ['d/m',
+        # 'd/m-d/m', ...]. So we iterate, split and parse the
+        # dates. A single date is treated as an interval that starts
+        # and ends on that date.
+        valid_intervals = []
+        for interval in intervals:
+            dates = [parse_day_month(in_year, d) for d in interval.split('-')]
+            valid_intervals.append((dates[0], dates[-1]))
+        return cls(name, tuple(valid_intervals))
 
     def valid_for(self, date):
         ''' Determine if a Location is valid on a given date.
@@ -173,10 +340,34 @@ class Location:
             True
             >>> loc.valid_for(datetime(2018, 3, 29))
             False '''
-        return date_in_intervals(date.date(), self.valid_intervals)
+        return self.valid_on(date.date())
+
+    def valid_on(self, day):
+        ''' Determine if a Location is valid on a given day.
+
+        Like valid_for, but for a date rather than a datetime, for
+        callers that have already converted it.
 
+        Args:
+            day (date): The day to query.
+
+        Returns:
+            bool: True if the day is a valid date, False otherwise. '''
+        return date_in_intervals(day, self.valid_intervals)
 
-@attr.s
+
+@functools.lru_cache(maxsize=4096)
+def _location(in_year, location_string):
+    ''' Memoised Location.from_string.
+
+    Every lecture of a course tends to list the same room, so the
+    activities share a single (immutable) Location instead of each
+    parsing their own copy. Pickle then stores each distinct location
+    once per course. '''
+    return Location.from_string(in_year, location_string)
+
+
+@attr.s(slots=True)
 class Activity:
     ''' The Activity class represents a single activity in a course.
 
@@ -185,13 +376,15 @@ class Activity:
     Attributes:
         activity_id ((int, int)): The id of the activity.
         day (int): The weekday this activity falls on (there can only be one).
-        start (datetime.time): The time of day this activity starts on.
-        end (datetime.time): The time of day this activity ends.
+        start (int): The time of day this activity starts on, in minutes
+                     after midnight.
+        end (int): The time of day this activity ends, in minutes after
+                   midnight.
         locations (list of Location): All the locations this Activity could be at.
     '''
     activity_id = attr.ib()
     name = attr.ib()
-    day = attr.ib(converter=list(calendar.day_name).index)
+    day = attr.ib(converter=_DAY_INDEX.__getitem__)
     start = attr.ib()
     end = attr.ib()
     valid_intervals = attr.ib()
@@ -199,12 +392,12 @@ class Activity:
 
     @property
     def exact_start(self):
-        ''' tuple of (int, datetime.time): Represents the exact start of the activity on a week (weekday and time). '''
+        ''' tuple of (int, int): Represents the exact start of the activity on a week (weekday and time). '''
         return (self.day, self.start)
 
     @property
     def exact_end(self):
-        ''' tuple of (int, datetime.time): Represents the exact end of the activity on a week (weekday and time). '''
+        ''' tuple of (int, int): Represents the exact end of the activity on a week (weekday and time). '''
         return (self.day, self.end)
 
     @classmethod
@@ -212,37 +405,42 @@ class Activity:
         ''' Returns an instance of Activity instantiated from an HTML element.
 
         Args:
-            activity_element (requests_html.Element): The element to instantiate from.
+            activity_element (lxml.html.HtmlElement): The element to instantiate from.
             in_year (int): The year the activity takes place in.
 
         Returns:
             Activity: The activity instantiated from the HTML element. '''
-        activity_id = activity_element.find(
-            'td[data-title=Activity]', first=True)
-        activity_day = activity_element.find('td[data-title=Day]', first=True)
-        activity_time = activity_element.find(
-            'td[data-title=Time]', first=True)
-        activity_location = activity_element.find(
-            'td[data-title=Location]', first=True)
-        activity_weeks = activity_element.find(
-            'td[data-title=Weeks]', first=True)
+        # Walk the row's cells once, indexing them by their column.
+        cells = {
+            cell.get('data-title'): cell
+            for cell in activity_element.iterchildren('td')
+        }
+        [activity_id, activity_day, activity_time, activity_location,
+         activity_weeks] = [
+             element_text(cells[column])
+             for column in ('Activity', 'Day', 'Time', 'Location', 'Weeks')
+         ]
         valid_intervals = [
             parse_week_interval(in_year, week)
-            for week in activity_weeks.text.split('\n')
+            for week in activity_weeks.split('\n')
         ]
         locations = [
-            Location.from_string(in_year, location_string.strip())
-            for location_string in activity_location.text.split('\n')
+            _location(in_year, location_string.strip())
+            for location_string in activity_location.split('\n')
             if location_string.strip() != ''
         ]
 
-        [start_time, end_time] = [
-            datetime.strptime(t.strip(), '%H:%M').time()
-            for t in activity_time.text.strip().split('-')
-        ]
-        act_id = parse_id(activity_id.text.strip())
-        return cls(act_id, name, activity_day.text.strip(), start_time,
-                   end_time, valid_intervals, locations)
+        time_match = _TIME_RE.fullmatch(activity_time.strip())
+        if time_match is None:
+            raise ValueError(
+                f'{repr(activity_time)} is not a valid time interval.')
+        start_hour, start_minute, end_hour, end_minute = map(
+            int, time_match.groups())
+        start_time = start_hour * 60 + start_minute
+        end_time = end_hour * 60 + end_minute
+        act_id = parse_id(activity_id.strip())
+        return cls(act_id, name, activity_day.strip(), start_time, end_time,
+                   valid_intervals, locations)
 
     def valid_for(self, date):
         ''' Return True if an Activity is valid on a particular date.
@@ -263,11 +461,13 @@ class Activity:
 
         Returns:
             Location: The location valid for this date (or None) if one doesn't exist. '''
-        return next((loc for loc in self.locations if loc.valid_for(date)),
+        # Convert the date once rather than once per location.
+        day = date.date()
+        return next((loc for loc in self.locations if loc.valid_on(day)),
                     None)
 
 
-@attr.s
+@attr.s(slots=True)
 class Course:
     ''' The Course class represents a single Course, and contains it's activities.
 
@@ -276,11 +476,15 @@ class Course:
         year (int): The year the course occurred in.
         semester (int): The semester the year the course occurred in.
         activities (list of Activity): The list of activities associated
-                                       with the Course. '''
+                                       with the Course, sorted by
+                                       start time.
+        fetched_at (date): The day the activities were last fetched
+                           (or None if they never have been). '''
     title = attr.ib()
     year = attr.ib()
     semester = attr.ib()
     activities = attr.ib(default=attr.Factory(list))
+    fetched_at = attr.ib(default=None)
 
     @property
     def url(self):
@@ -295,20 +499,29 @@ class Course:
     def fetch_activities(self):
         ''' Download the course details page (at self.url) and scrape
         Activities from it. '''
-        session = HTMLSession()
-        with session.get(self.url) as r:
-            activities = []
-            last_section = None
-            for element in r.html.find('table#RepeatTable tbody, tr.datarow'):
-                if element.element.tag == 'tbody':
-                    # Activity header
-                    last_section = element
-                else:
-                    activities.append((last_section, element))
-            self.activities = [
-                Activity.from_element(section.text, self.year, e)
-                for section, e in activities
-            ]
+        from lxml import html
+        with http_session().get(self.url, timeout=FETCH_TIMEOUT) as r:
+            # An error page has no activities on it either, and must not
+            # be mistaken for (and cached as) a course without any.
+            r.raise_for_status()
+            root = html.fromstring(r.content)
+        activities = []
+        last_section = None
+        for element in _rows_xpath()(root):
+            if element.tag == 'tbody':
+                # Activity header. Every activity in the section shares
+                # the one interned name, which is also used as part of
+                # the selected activity keys.
+                last_section = sys.intern(element_text(element))
+            else:
+                activities.append((last_section, element))
+        # Keep the activities sorted by start time, so anything
+        # that filters them gets them back in order for free.
+        self.activities = sorted(
+            (Activity.from_element(section, self.year, e)
+             for section, e in activities),
+            key=attrgetter('start'))
+        self.fetched_at = dt.date.today()
 
     def activities_on(self, date):
         ''' Return a list of activities on a particular day, in sorted order.
@@ -319,8 +532,7 @@ class Course:
         Returns:
             list of Activity: A sorted (by start time) list of
                               Activities on the given day. '''
-        activities = [act for act in self.activities if act.valid_for(date)]
-        return sorted(activities, key=lambda act: act.start)
+        return [act for act in self.activities if act.valid_for(date)]
 
 
 def activities_on(courses, date, selected_activities):
@@ -338,19 +550,14 @@ def activities_on(courses, date, selected_activities):
                                     student.
     Returns:
         list of (timetable.Course, timetable.Activity): The relevant activities. '''
-    # Chain all course activities such they are an iterable in the
-    # following form:
-    # (course, activity), (course, activity1), ...
-    activities = itertools.chain(*(
-        zip(itertools.cycle([course]), course.activities)
-        for course in courses))
-    # Filter the activities, first by if they are an activity the user
-    # is taking part in, and then by whether that activity is relevant
-    # to the date.
+    # Pair every activity with its course, keeping only the activities
+    # the user is taking part in that are relevant to the date.
     filtered_activities = [
-        (course, activity) for course, activity in activities
+        (course, activity) for course in courses
+        for activity in course.activities
         if activity.activity_id[0] == selected_activities.get((
             course.title, activity.name), 1) and activity.valid_for(date)
     ]
     # Sort the activities by their start date
-    return sorted(filtered_activities, key=lambda capair: capair[1].start)
+    filtered_activities.sort(key=lambda capair: capair[1].start)
+    return filtered_activities